@@ -1,43 +1,57 @@
 from __future__ import division
 # import sympy
-from sympy import simplify, Function, latex, prod, Symbol, Mul, Add, flatten, factorial, Derivative, diff, sympify
+from sympy import simplify, S, Basic, Function, latex, prod, Symbol, Mul, Add, flatten, factorial, Derivative, diff, sympify
 from sympy import Rational as frac
-from copy import deepcopy
 from string import maketrans
+from memoize import memoize
 
 TranslationTable = maketrans(r'[]{}',r'()()')
 
+# Compiled once at module load; `DifferentiateString` is called every
+# time a vector is differentiated, so it shouldn't recompile its
+# pattern (or backtrack through `.*?`) on each call.
+import re
+_DifferentiatePattern = re.compile(r'\\partial_([^\^]+)\^\{([^}]+)\}(.*)', re.DOTALL)
+
 def DifferentiateString(s, param='t'):
     "Add latex to string indicating differentiation by time."
-    if(s.startswith(r'\partial_{0}^{{'.format(param))):
-        from re import sub
-        def increment_match(match):
-            return r'\partial_{0}^{{{1}}}{2}'.format(param, int(match.group(1))+1, match.group(2))
-        return sub(r'\\partial_.*?\^\{(.*?)\}(.*)', increment_match, s)
-    elif(s.startswith(r'\partial_{0}'.format(param))):
-        return r'\partial_{0}^{{2}}'.format(param) + s[10:]
+    prefix = r'\partial_{0}'.format(param)
+    if(s.startswith(prefix+'^{')):
+        match = _DifferentiatePattern.match(s)
+        return r'\partial_{0}^{{{1}}}{2}'.format(param, int(match.group(2))+1, match.group(3))
+    elif(s.startswith(prefix)):
+        return r'\partial_{0}^{{2}}'.format(param) + s[len(prefix):]
     else:
         return r'\partial_{0} '.format(param) + s
 
+# The delimiter tables for `DelimitString`, built once at module load;
+# this function runs on every (nested) str/repr/latex rendering, so it
+# shouldn't rebuild its tables -- or scan the string twice -- per call.
+_LatexDelimiterOpeners, _LatexDelimiterClosers = ['(','[',r'\{'], [')',']',r'\}']
+_PlainDelimiterOpeners, _PlainDelimiterClosers = '([{', ')]}'
+_LatexOpenerSet = frozenset(_LatexDelimiterOpeners)
+_PlainOpenerSet = frozenset(_PlainDelimiterOpeners)
+
 def DelimitString(S, latex=True):
     "Surround string by parentheses, brackets, or braces as appropriate"
     if(latex):
         left, right = [r'\left', r'\right']
-        DelimiterOpeners, DelimiterClosers = [['(','[',r'\{'], [')',']',r'\}']]
+        DelimiterOpeners, DelimiterClosers = [_LatexDelimiterOpeners, _LatexDelimiterClosers]
+        OpenerSet = _LatexOpenerSet
     else:
         left, right = ['', '']
-        DelimiterOpeners, DelimiterClosers = ['([{', ')]}']
-    def FindFirst(S, D):
-        for i,s in enumerate(S):
-            if(s=='\\' and i+1<len(S)):
-                s += S[i+1]
-            for d in D:
-                if(s==d):
-                    return d
-    FirstDelim = FindFirst(S, DelimiterOpeners)
+        DelimiterOpeners, DelimiterClosers = [_PlainDelimiterOpeners, _PlainDelimiterClosers]
+        OpenerSet = _PlainOpenerSet
+    FirstDelim = None
+    for i,s in enumerate(S):
+        if(s=='\\' and i+1<len(S)):
+            s += S[i+1]
+        if(s in OpenerSet):
+            FirstDelim = s
+            break
     if(not FirstDelim):
         return left+'('+S+right+')'
-    NewDelimiterIndex = (DelimiterOpeners.index(FindFirst(S, DelimiterOpeners))+1) % len(DelimiterOpeners)
+    NewDelimiterIndex = (DelimiterOpeners.index(FirstDelim)+1) % len(DelimiterOpeners)
     return r'{0}{1} {2} {3}{4}'.format(left, DelimiterOpeners[NewDelimiterIndex],
                                        S, right, DelimiterClosers[NewDelimiterIndex])
 
@@ -63,6 +77,67 @@ def LatexSubs(S, subsargs, subskwargs):
     return r'\left.' + S + r'\right|_{{{0}}}'.format(subsstring)
 
 
+def ArgumentSet(obj):
+    """Return the cached set of `obj`'s sympy args
+
+    `TensorProduct` and `Tensor` build their argument tuples from the
+    args of their children, and used to re-flatten every child's args
+    on every construction.  Instead, the frozenset is computed once
+    per object and cached on it, so a new product just unions the
+    caches of its children.
+
+    """
+    try:
+        return obj._argument_set
+    except AttributeError:
+        argset = frozenset(obj.args)
+        obj._argument_set = argset
+        return argset
+
+
+def ShortCircuitProduct(factors):
+    """Multiply the factors, returning zero on the first zero factor
+
+    `prod` evaluates every factor even when one of them is zero, only
+    for sympy's `Mul` to collapse the whole thing to zero afterwards.
+    In contractions over orthogonal basis vectors most products have a
+    vanishing factor, so bailing out early skips most of the work.
+
+    """
+    result = S.One
+    for factor in factors:
+        if(factor is S.Zero or factor==0):
+            return S.Zero
+        result = result*factor
+    return result
+
+
+_simplify_cache = {}
+def CachedSimplify(expr):
+    """Memoized version of sympy's `simplify`
+
+    The contraction and trace code below tends to call `simplify` on
+    the same scalar expressions many times over -- especially when
+    iterating over permutations of a symmetric tensor product, where
+    the same pairwise contraction shows up in up to `rank!` terms.
+    This function simply caches the results, keyed on the `srepr` of
+    the input expression (which, unlike the expression itself, is
+    always hashable).
+
+    """
+    from sympy import srepr
+    try:
+        key = srepr(expr)
+    except Exception:
+        return simplify(expr)
+    try:
+        return _simplify_cache[key]
+    except KeyError:
+        result = simplify(expr)
+        _simplify_cache[key] = result
+        return result
+
+
 def ReduceExpr(expr):
     if isinstance(expr, (TensorFunction, TensorProductFunction,)):
         return expr
@@ -101,9 +176,10 @@ class VectorFunction(Function):
     _op_priority = 1000000.0
     components = None
     coefficient = sympify(1)
-    @property
-    def _is_vector(self):
-        return True
+    # A plain class attribute; the arithmetic dispatch only ever does
+    # `hasattr`/truth tests on this, so there's no reason to pay for
+    # the descriptor protocol of a property on every check.
+    _is_vector = True
     def __eq__(self, other):
         try:
             if(len(self.components)!=len(other.components)):
@@ -124,7 +200,9 @@ class VectorFunction(Function):
         vectors `v` and `w` is just `v|w`.  This notation will
         be used in the tensor classes also.
         """
-        return self.coefficient*other.coefficient * sum( s*o for s,o in zip(self, other) )
+        # `Add(*...)` builds the sum in one shot, rather than through
+        # an intermediate Add per component as built-in `sum` would.
+        return self.coefficient*other.coefficient * Add( *[s*o for s,o in zip(self, other)] )
     def __iter__(self):
         for c in self.__class__.components: yield c
     def __len__(self):
@@ -252,7 +330,7 @@ class VectorFunction(Function):
     def _repr_latex_(self):
         return self.latex_name
 
-_Vector_count = 0
+@memoize
 def Vector(Name, LatexName, ComponentFunctions):
     """Create a new vector function
 
@@ -267,18 +345,18 @@ def Vector(Name, LatexName, ComponentFunctions):
     *args, **kwargs`, and evaluate the value of the derivative from
     that information.  Finally, the class is renamed to carry the
     input name, so that sympy output looks nice, etc.
+
+    Note that this factory is memoized: asking for the same vector
+    twice -- which happens constantly when differentiating, since
+    `fdiff` builds the derivative vector anew on each call -- returns
+    the class built the first time, rather than minting another
+    identical subclass.
     """
     if(ComponentFunctions == [0,]*len(ComponentFunctions)):
         return sympify(0)
-    ## Now, create the object and set its data.  Because of sympy's
-    ## caching, vectors with different data need to be created as
-    ## classes with different names.  So we just create a lighweight
-    ## subclass with a unique name (the number at the end gets
-    ## incremented every time we construct a vector).
-    # global _Vector_count
-    # ThisVectorFunction = type('VectorFunction_'+str(_Vector_count),
-    #                           (VectorFunction,), {})
-    # _Vector_count += 1
+    ## Now, create the class and set its data.  The class carries the
+    ## input name, so that sympy output looks nice; thanks to the
+    ## memoization above, each named vector gets exactly one class.
     ThisVectorFunction = type(Name, (VectorFunction,), {})
     ThisVectorFunction.name = Name
     ThisVectorFunction.latex_name = LatexName
@@ -295,7 +373,32 @@ zHat = Vector('zHat', r'\hat{z}', [0,0,1])
 ### Now, the tensor products ###
 ################################
 class TensorProductFunction(Function):
+    # All the instance data lives in these slots; instances are
+    # created through `Basic.__new__` in the `TensorProduct` factory,
+    # which fills them in.  `rank` is set once at construction, and
+    # `_is_tensor_product` is a plain class attribute, since the
+    # arithmetic dispatch touches both constantly.
+    __slots__ = ['vectors', 'coefficient', 'symmetric', 'rank',
+                 '_argument_set', '_basis_key']
     _op_priority = 1000001.0
+    _is_tensor_product = True
+
+    @property
+    def func(self):
+        """Return a reconstructor for this tensor product
+
+        Sympy rebuilds expressions as `expr.func(*expr.args)`, but the
+        vectors and coefficient live outside the args, so rebuilding
+        through the class would lose them.  Return a callable that
+        hands back the already-built object instead.  (The per-call
+        classes this module used to mint satisfied the same invariant
+        through sympy's instance cache.)
+
+        """
+        def reconstruct(*args):
+            return self
+        return reconstruct
+
     @property
     def LaTeXProductString(self):
         if(self.symmetric):
@@ -303,22 +406,58 @@ class TensorProductFunction(Function):
         else:
             return r' \otimes '
 
-    @property
-    def _is_tensor_product(self):
-         return True
-
-    @property
-    def rank(self):
-        return len(self.vectors)
-
     def __iter__(self):
         for v in self.vectors: yield v
 
+    def __eq__(self, other):
+        """Compare by content, not by args
+
+        With a single shared class, the inherited comparison would
+        only look at the type and the args -- which are just the
+        union of the vectors' function arguments, usually `(t,)` --
+        and so would conflate entirely different products.
+
+        """
+        if(self is other):
+            return True
+        if(not isinstance(other, TensorProductFunction)):
+            return False
+        return (self.symmetric==other.symmetric
+                and self.coefficient==other.coefficient
+                and self.basis_element_key()==other.basis_element_key())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.symmetric, self.coefficient, self.basis_element_key()))
+
     def has_same_basis_element(self, B):
-        if(self.symmetric):
-            from collections import Counter
-            return Counter(self.vectors) == Counter(B.vectors)
-        return self.vectors == B.vectors
+        return self.basis_element_key() == B.basis_element_key()
+
+    def basis_element_key(self):
+        """Return a hashable key identifying this product's basis element
+
+        Two tensor products get the same key exactly when they have
+        the same basis element, but -- unlike the vectors themselves
+        -- the key can be used in a dict, so matching basis elements
+        can be found by hashing rather than by comparing all pairs.
+        For symmetric products the ordering of the vectors is
+        irrelevant, so the key is sorted.  The key is computed once
+        and cached on the instance, since the vectors never change
+        after construction.
+
+        """
+        try:
+            return self._basis_key
+        except AttributeError:
+            vector_keys = [(v.name, str(v.args), str(v.components)) for v in self.vectors]
+            if(self.symmetric):
+                key = tuple(sorted(vector_keys))
+            else:
+                key = tuple(vector_keys)
+            self._basis_key = key
+            return key
 
     def ordered_as(self, index_set):
         for i in index_set:
@@ -326,21 +465,67 @@ class TensorProductFunction(Function):
 
     def __ror__(self,other):
         return self.__or__(other)
-    def __or__(self,B):
+    def __or__(self,B, ip_table=None):
+        """Contract with another tensor product
+
+        If `ip_table` is given, it must be a dict mapping pairs
+        `(id(v), id(w))` of vector ids to the (simplified) inner
+        product `v|w`; `TensorFunction.__or__` precomputes such a
+        table once for all of its terms, rather than recomputing the
+        same inner products for every pair of terms.
+
+        """
         if(B.rank != self.rank):
             raise ValueError("Cannot contract rank-{0} tensor with rank-{1} tensor.".format(self.rank, B.rank))
         if(isinstance(B, TensorProductFunction)):
             if(self.symmetric):
-                from itertools import permutations
+                from sympy.utilities.iterables import multiset_permutations
                 # It suffices to just iterate over rearrangements of `self`.
-                coefficient = simplify(self.coefficient*B.coefficient*frac(1,factorial(self.rank)))
+                coefficient = CachedSimplify(self.coefficient*B.coefficient*frac(1,factorial(self.rank)))
                 if(coefficient==0): return sympify(0)
-                return simplify( coefficient * sum([prod([v|w for v,w in zip(self.ordered_as(index_set), B)])
-                                                    for index_set in permutations(range(self.rank))]) )
-            return (self.coefficient*B.coefficient)*prod([v|w for v,w in zip(self, B)])
+                # Group our vectors into distinct elements, and only
+                # iterate over the distinct orderings of those.  Each
+                # distinct ordering stands in for prod(multiplicity!)
+                # identical permutations, so tensor products with
+                # repeated vectors (the usual case) need far fewer
+                # than the full rank! products.
+                unique = []
+                labels = []
+                for v in self.vectors:
+                    for lab,u in enumerate(unique):
+                        if(u==v):
+                            labels.append(lab)
+                            break
+                    else:
+                        labels.append(len(unique))
+                        unique.append(v)
+                weight = prod([factorial(labels.count(lab)) for lab in range(len(unique))])
+                # Precompute the pairwise contractions, so that each
+                # `v|w` is simplified just once, rather than once per
+                # permutation it appears in.
+                Bv = B.vectors
+                if(ip_table is not None):
+                    G = [[ip_table[(id(u), id(w))] for w in Bv] for u in unique]
+                else:
+                    G = [[CachedSimplify(u|w) for w in Bv] for u in unique]
+                # Plain indexing here; generators and zips cost real
+                # interpreter time when repeated over every ordering.
+                rank = self.rank
+                return simplify( coefficient * weight
+                                 * sum([ShortCircuitProduct(G[index_set[k]][k] for k in range(rank))
+                                        for index_set in multiset_permutations(labels)]) )
+            sv = self.vectors
+            Bv = B.vectors
+            rank = self.rank
+            if(ip_table is not None):
+                return (self.coefficient*B.coefficient)*ShortCircuitProduct(ip_table[(id(sv[k]), id(Bv[k]))]
+                                                                            for k in range(rank))
+            return (self.coefficient*B.coefficient)*ShortCircuitProduct(sv[k]|Bv[k] for k in range(rank))
         else:
             try:
-                return sum( [(self|t_p) for t_p in B] )
+                # A full contraction is a scalar, so the terms can be
+                # summed directly with a single Add.
+                return Add( *[(self|t_p) for t_p in B] )
             except AttributeError:
                 raise ValueError("Don't know how to contract TensorProductFunction with '{0}'".format(type(B)))
 
@@ -348,16 +533,20 @@ class TensorProductFunction(Function):
         # print("\nTP.trace({0}, {1}) running on rank {2} {3}tensor {4}".format(j,k,self.rank, ('symmetric ' if self.symmetric else ''), self))
         if(not self.symmetric and (j==-1 or k==-1)):
             raise TypeError("trace() takes exactly 3 arguments for non-symmetric tensor products (1 given)")
-        coefficient = simplify(self.coefficient * (self.vectors[j]|self.vectors[k]))
+        coefficient = CachedSimplify(self.coefficient * (self.vectors[j]|self.vectors[k]))
         if(self.rank==2):
             # print("Finished TP.trace 1\n")
             return coefficient
         if(self.symmetric):
             from itertools import permutations
+            # Precompute the pairwise contractions, so each is only
+            # simplified once, however many index pairs reuse it.
+            contraction = dict( ((j,k), CachedSimplify(self.vectors[j]|self.vectors[k]))
+                                for j,k in permutations(range(self.rank), 2) )
             T = 0
             for j,k in permutations(range(self.rank), 2):
                 # print(j,k)
-                coefficient = simplify( self.coefficient * (self.vectors[j]|self.vectors[k]) )
+                coefficient = CachedSimplify( self.coefficient * contraction[(j,k)] )
                 if(coefficient==0):
                     continue
                 T += TensorProduct(list(v for i,v in enumerate(self.vectors) if (i!=j and i!=k)),
@@ -387,10 +576,12 @@ class TensorProductFunction(Function):
             # Fall back to Tensor.__rmul__ by doing this:
             return NotImplemented
         if(isinstance(B, TensorProductFunction)):
-            # Do tensor product
+            # Do tensor product.  Note that the coefficient is left
+            # unsimplified; sympy's `Mul` canonicalizes cheaply, and
+            # the caller can `simplify()` the final result just once.
             # print('TensorProductFunction.__mul__ return 1')
             return TensorProduct(self.vectors + B.vectors,
-                                 coefficient=simplify( self.coefficient * B.coefficient ),
+                                 coefficient=self.coefficient * B.coefficient,
                                  symmetric = self.symmetric)
         elif(isinstance(B, VectorFunction)):
             # print('TensorProductFunction.__mul__ return 2')
@@ -398,10 +589,19 @@ class TensorProductFunction(Function):
                                  coefficient=self.coefficient,
                                  symmetric = self.symmetric)
         else:
-            try:
-                if(simplify(B)==0): return sympify(0)
-            except:
-                pass
+            ## Tiered zero test: an identity check, then sympy's
+            ## cached assumption, and only if that is inconclusive
+            ## fall back to the full simplifier.
+            if(B is S.Zero or B==0):
+                return sympify(0)
+            B_is_zero = getattr(B, 'is_zero', None)
+            if(B_is_zero is True):
+                return sympify(0)
+            if(B_is_zero is None):
+                try:
+                    if(simplify(B)==0): return sympify(0)
+                except:
+                    pass
             # Otherwise, try scalar multiplication
             # print('TensorProductFunction.__mul__ return 3')
             return TensorProduct(self.vectors,
@@ -417,10 +617,11 @@ class TensorProductFunction(Function):
             # Fall back to Tensor.__rmul__ by doing this:
             return NotImplemented
         if(isinstance(B, TensorProductFunction)):
-            # Do tensor product
+            # Do tensor product, again leaving the coefficient
+            # unsimplified until the caller asks for it.
             # print('TensorProductFunction.__rmul__ return 1')
             return TensorProduct(B.vectors+self.vectors,
-                                 coefficient=simplify( B.coefficient * self.coefficient ),
+                                 coefficient=B.coefficient * self.coefficient,
                                  symmetric = self.symmetric)
         elif(isinstance(B, VectorFunction)):
             # print('TensorProductFunction.__rmul__ return 2')
@@ -428,10 +629,17 @@ class TensorProductFunction(Function):
                                  coefficient=self.coefficient,
                                  symmetric = self.symmetric)
         else:
-            try:
-                if(simplify(B)==0): return sympify(0)
-            except:
-                pass
+            ## Tiered zero test, as in `__mul__` above.
+            if(B is S.Zero or B==0):
+                return sympify(0)
+            B_is_zero = getattr(B, 'is_zero', None)
+            if(B_is_zero is True):
+                return sympify(0)
+            if(B_is_zero is None):
+                try:
+                    if(simplify(B)==0): return sympify(0)
+                except:
+                    pass
             # Otherwise, try scalar multiplication
             # print('TensorProductFunction.__rmul__ return 3')
             return TensorProduct(self.vectors,
@@ -469,12 +677,17 @@ class TensorProductFunction(Function):
         from sympy.core.function import ArgumentIndexError
         if (argindex != 1):
             raise ArgumentIndexError(self, argindex)
-        TP = TensorProduct(list(self.vectors),
-                           coefficient = diff(self.coefficient, self.args[0]),
-                           symmetric = self.symmetric) \
-            + sum( [ TensorProduct([diff(t, self.args[0]) if i==j else t for j,t in enumerate(self)],
-                                   coefficient = self.coefficient, symmetric=self.symmetric)
-                     for i in range(self.rank) ] )
+        ## Collect all the Leibniz-rule terms into a single list and
+        ## build one Tensor from them, rather than summing term by
+        ## term (which constructs and compresses a new Tensor at
+        ## every step of the sum).
+        terms = [ TensorProduct(list(self.vectors),
+                                coefficient = diff(self.coefficient, self.args[0]),
+                                symmetric = self.symmetric) ]
+        terms += [ TensorProduct([diff(t, self.args[0]) if i==j else t for j,t in enumerate(self)],
+                                 coefficient = self.coefficient, symmetric=self.symmetric)
+                   for i in range(self.rank) ]
+        TP = Tensor(terms)
         try:
             return TP.compress()
         except AttributeError:
@@ -501,7 +714,9 @@ class TensorProductFunction(Function):
                         else: # Assume it's a vector
                             newVectors[i] = value
             else:
-                newCoefficient = newCoefficient.xreplace({query:value})
+                # The coefficient may be a plain int (the default 1),
+                # which has no xreplace of its own.
+                newCoefficient = sympify(newCoefficient).xreplace({query:value})
         TP = TensorProduct(newVectors,
                            coefficient=newCoefficient,
                            symmetric=self.symmetric)
@@ -531,6 +746,19 @@ class TensorProductFunction(Function):
                 pass
             return TP
 
+    def simplify(self):
+        """Simplify the coefficient of this tensor product
+
+        The arithmetic operations above deliberately leave their
+        coefficients unsimplified, since intermediate results are
+        usually multiplied or added further anyway; call this once on
+        the final result.
+
+        """
+        return TensorProduct(list(self.vectors),
+                             coefficient=simplify(self.coefficient),
+                             symmetric=self.symmetric)
+
     def series(self, *args, **kwargs):
         try:
             coefficient = self.coefficient.series(*args, **kwargs).removeO()
@@ -573,7 +801,6 @@ class TensorProductFunction(Function):
     def _repr_latex_(self):
         return '$'+ self._latex_str_() + '$'
 
-_TensorProduct_count = 0
 def TensorProduct(*input_vectors, **kwargs):
     if('coefficient' in kwargs and kwargs['coefficient']==0):
         return sympify(0)
@@ -585,13 +812,13 @@ def TensorProduct(*input_vectors, **kwargs):
         return kwargs.get('coefficient', sympify(1))
     if(len(input_vectors)==1 and isinstance(input_vectors[0], TensorProductFunction)) :
         vectors = list(input_vectors[0].vectors)
-        coefficient = deepcopy(input_vectors[0].coefficient)
+        coefficient = input_vectors[0].coefficient
         symmetric = bool(input_vectors[0].symmetric)
     else:
         if(len(input_vectors)==1 and isinstance(input_vectors[0], list)):
             input_vectors = input_vectors[0]
         vectors = list(input_vectors)
-        coefficient = deepcopy(kwargs.get('coefficient', 1))
+        coefficient = kwargs.get('coefficient', 1)
         symmetric = bool(kwargs.get('symmetric', True))
 
     ## Now, make sure none of the input vectors are zero
@@ -599,23 +826,20 @@ def TensorProduct(*input_vectors, **kwargs):
         if v==0:
             return sympify(0)
 
-    ## Finally, create the object and set its data.  Because of
-    ## sympy's caching, tensor products with different data need to be
-    ## created as classes with different names.  So we just create a
-    ## lighweight subclass with a unique name (the number at the end
-    ## gets incremented every time we construct a tensor product).
-    global _TensorProduct_count
-    ThisTensorProductFunction = type('TensorProductFunction_'+str(_TensorProduct_count),
-                                     (TensorProductFunction,), {})
-    _TensorProduct_count += 1
-    # print('About to construct a tensor with args ',
-    #       tuple( set( flatten( [v.args for v in vectors] ) ) ),
-    #       input_vectors,
-    #       kwargs,
-    #       vectors,
-    #       [v.args for v in vectors] )
-    TP = ThisTensorProductFunction( *tuple( set( flatten( [v.args for v in vectors] ) ) ) )
+    ## Finally, create the object and set its data.  The instance is
+    ## created directly through `Basic.__new__`, which bypasses
+    ## sympy's instance cache; tensor products carry data (vectors,
+    ## coefficient) that is not part of their `args`, so cached
+    ## instances with the same args must not be shared.  (This used to
+    ## be done by minting a uniquely named subclass for every call,
+    ## which put a class construction on the hot arithmetic path.)
+    argset = frozenset()
+    for v in vectors:
+        argset |= ArgumentSet(v)
+    TP = Basic.__new__( TensorProductFunction, *tuple(argset) )
+    TP._argument_set = argset
     TP.vectors = vectors
+    TP.rank = len(vectors)
     TP.coefficient = coefficient
     TP.symmetric = symmetric
     return TP
@@ -635,20 +859,42 @@ class TensorFunction(Function):
     You probably won't need to use this class directly; it is just the
     base class for the class created in Tensor below.
     """
+    __slots__ = ['tensor_products', 'rank', '_argument_set']
     _op_priority = 1000002.0
+    _is_tensor = True
 
     @property
-    def _is_tensor(self):
-        """Since this is a property, it can be called without parentheses.
-        But I want to make sure it applies to the instance, not the
-        class, so it shouldn't just be a variable."""
-        return True
+    def func(self):
+        """Return a reconstructor for this tensor
 
-    @property
-    def rank(self):
-        if(len(self.tensor_products)==0):
-            return sympify(0)
-        return self.tensor_products[0].rank
+        As with `TensorProductFunction.func` above: the tensor
+        products live outside the args, so `expr.func(*expr.args)`
+        must hand back the already-built object rather than rebuild
+        through the class.
+
+        """
+        def reconstruct(*args):
+            return self
+        return reconstruct
+
+    def __eq__(self, other):
+        """Compare by content, not by args
+
+        See `TensorProductFunction.__eq__`; the same aliasing would
+        happen here for tensors sharing the one class.
+
+        """
+        if(self is other):
+            return True
+        if(not isinstance(other, TensorFunction)):
+            return False
+        return self.tensor_products == other.tensor_products
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(tuple(self.tensor_products))
 
     def __iter__(self):
         if self.tensor_products:
@@ -657,46 +903,36 @@ class TensorFunction(Function):
             raise StopIteration()
 
     def compress(self):
-        # def debugcompress(s):
-        #     print(s)
-        # debugcompress("\ncompressing")
-        # debugcompress(self)
-        removed_elements = []
-        for i in range(len(self.tensor_products)):
-            # debugcompress("\t%s"%i)
-            if(i in removed_elements):
-                # debugcompress("\t\tskipping %s"%i)
+        ## Bucket the terms by their basis elements, so that matching
+        ## terms are found by a dict lookup rather than by comparing
+        ## every pair of terms.  The coefficients in each bucket are
+        ## added with a plain sum (sympy defers the real work), and
+        ## simplified just once per bucket.
+        buckets = []
+        bucket_indices = {}
+        for t_p in self.tensor_products:
+            if(t_p==0 or t_p.coefficient==0):
                 continue
-            for j in range(i+1,len(self.tensor_products)):
-                # debugcompress("\t\t%s"%j)
-                if(j in removed_elements):
-                    # debugcompress("\t\t\tskipping %s"%j)
-                    continue
-                if self.tensor_products[i].has_same_basis_element(self.tensor_products[j]):
-                    # debugcompress("Removing {0} because {1} is already here".format(j,i))
-                    removed_elements.append(j)
-                    NewCoefficient = simplify( self.tensor_products[i].coefficient + self.tensor_products[j].coefficient )
-                    if(NewCoefficient==0):
-                        # debugcompress("Also removing {0} because {1} cancelled it out".format(i,j))
-                        removed_elements.append(i)
-                        break
-                    self.tensor_products[i] = TensorProduct(self.tensor_products[i].vectors,
-                                                            coefficient=NewCoefficient,
-                                                            symmetric=self.tensor_products[i].symmetric)
-                # debugcompress("\t\t\tfinished %s"%j)
-            # debugcompress("\t\tfinished j loop for %s"%i)
-            if removed_elements:
-                if(self.tensor_products[i].coefficient==0 or self.tensor_products[i]==0):
-                    removed_elements += [i]
-                # debugcompress("Removing {0} because {1} is already here".format(removed_elements,i))
-            # debugcompress("\t\tfinished %s"%i)
-        # debugcompress("compression results in {0} elements".format(len(self.tensor_products) - len(removed_elements)))
-        self.tensor_products = list(t_p for i,t_p in enumerate(self) if i not in removed_elements and t_p!=0 and t_p.coefficient!=0)
-        # debugcompress("compression results in {0} elements:\n{1}\n.\n".format(len(self.tensor_products), self.tensor_products))
+            key = t_p.basis_element_key()
+            if(key in bucket_indices):
+                buckets[bucket_indices[key]].append(t_p)
+            else:
+                bucket_indices[key] = len(buckets)
+                buckets.append([t_p,])
+        compressed = []
+        for bucket in buckets:
+            if(len(bucket)==1):
+                compressed.append(bucket[0])
+                continue
+            NewCoefficient = simplify( sum(t_p.coefficient for t_p in bucket) )
+            if(NewCoefficient==0):
+                continue
+            compressed.append( TensorProduct(bucket[0].vectors,
+                                             coefficient=NewCoefficient,
+                                             symmetric=bucket[0].symmetric) )
+        self.tensor_products = compressed
         if not self.tensor_products:
-            # debugcompress("compressed to 0")
             return sympify(0)
-        # debugcompress("compressed to {0}\n".format(self))
         return self
 
     def __add__(self, T):
@@ -750,20 +986,44 @@ class TensorFunction(Function):
             return self
         if(T.rank!=self.rank):
             raise ValueError("Cannot add rank-{0} tensor to rank-{1} tensor.".format(T.rank, self.rank))
+        ## Negate through our own __rmul__, which flips each term's
+        ## coefficient; running the negated tensor through the global
+        ## `simplify` would just hand it to sympy's generic machinery.
         if(isinstance(T, TensorFunction)) :
-            return Tensor(self.tensor_products + simplify(-1*T).tensor_products)
+            return Tensor(self.tensor_products + (-1*T).tensor_products)
         elif(isinstance(T, TensorProductFunction)) :
-            return Tensor(self.tensor_products + [simplify(-1*T),])
+            return Tensor(self.tensor_products + [-1*T,])
 
     def __ror__(self,other):
         return self.__or__(other)
     def __or__(self, B):
         if(B.rank != self.rank):
             raise ValueError("Cannot contract rank-{0} tensor with rank-{1} tensor.".format(self.rank, B.rank))
+        ## Precompute every distinct pairwise inner product once, so
+        ## that the loop over pairs of terms below just looks them up,
+        ## instead of recomputing the same `v|w` for every pair of
+        ## terms sharing those vectors.
+        left = {}
+        for T1 in self:
+            for v in T1.vectors:
+                left[id(v)] = v
+        right = {}
         if(isinstance(B, TensorFunction)) :
-            return sum([T1|T2 for T1 in self for T2 in B])
+            for T2 in B:
+                for w in T2.vectors:
+                    right[id(w)] = w
         elif(isinstance(B, TensorProductFunction)) :
-            return sum([T1|B  for T1 in self])
+            for w in B.vectors:
+                right[id(w)] = w
+        else:
+            return NotImplemented
+        ip_table = dict( ((i,j), CachedSimplify(v|w))
+                         for i,v in left.items() for j,w in right.items() )
+        # A full contraction is a scalar, so the terms can be summed
+        # directly with a single Add.
+        if(isinstance(B, TensorFunction)) :
+            return Add(*[T1.__or__(T2, ip_table) for T1 in self for T2 in B])
+        return Add(*[T1.__or__(B, ip_table)  for T1 in self])
 
     def trace(self, j=0, k=1):
         # print("\nSumming trace")
@@ -772,7 +1032,13 @@ class TensorFunction(Function):
         #     # print(T)
         #     # print("")
         # print("The sum will run next:")
-        t = sum([T.trace(j,k) for T in self])
+        if(self.rank==2):
+            # Rank-2 traces are scalars, so they can be summed in one
+            # shot; higher-rank traces are tensors, which need to go
+            # through the tensor __add__ machinery.
+            t = Add(*[T.trace(j,k) for T in self])
+        else:
+            t = sum([T.trace(j,k) for T in self])
         # print("Sum:", t)
         try:
             # print("Trying to compress the Tensor trace")
@@ -788,8 +1054,20 @@ class TensorFunction(Function):
     def __mul__(self, other):
         # print('TensorFunction.__rmul__<{0},{1}>({2},{3})'.format(type(self), type(other), self, other))
         if(isinstance(other, TensorFunction)):
+            ## Fused double loop: build each product term directly,
+            ## rather than dispatching through
+            ## TensorProductFunction.__mul__ and its branch checks for
+            ## every pair of terms, and compress the result just once.
             # print('TensorFunction.__mul__ return 1')
-            return Tensor(list(t_pA*t_pB for t_pA in self for t_pB in other))
+            T = Tensor([TensorProduct(t_pA.vectors + t_pB.vectors,
+                                      coefficient=t_pA.coefficient * t_pB.coefficient,
+                                      symmetric=t_pA.symmetric)
+                        for t_pA in self.tensor_products
+                        for t_pB in other.tensor_products])
+            try:
+                return T.compress()
+            except AttributeError:
+                return T
         else:
             # print('TensorFunction.__mul__ return 2')
             return Tensor(list(t_p*other for t_p in self))
@@ -797,8 +1075,18 @@ class TensorFunction(Function):
     def __rmul__(self, other):
         # print('TensorFunction.__rmul__<{0},{1}>({2},{3})'.format(type(self), type(other), self, other))
         if(isinstance(other, TensorFunction)):
+            ## Fused double loop, as in `__mul__` above, but with the
+            ## other tensor's vectors on the left.
             # print('TensorFunction.__rmul__ return 1')
-            return Tensor(list(t_pB*t_pA for t_pA in self for t_pB in other))
+            T = Tensor([TensorProduct(t_pB.vectors + t_pA.vectors,
+                                      coefficient=t_pB.coefficient * t_pA.coefficient,
+                                      symmetric=t_pB.symmetric)
+                        for t_pA in self.tensor_products
+                        for t_pB in other.tensor_products])
+            try:
+                return T.compress()
+            except AttributeError:
+                return T
         else:
             # print('TensorFunction.__rmul__ return 2')
             return Tensor(list(t_p*other for t_p in self))
@@ -829,7 +1117,19 @@ class TensorFunction(Function):
         from sympy.core.function import ArgumentIndexError
         if (argindex != 1):
             raise ArgumentIndexError(self, argindex)
-        T = sum(diff(t_p, self.args[0]) for t_p in self)
+        ## Batch the derivatives of all the tensor products into one
+        ## Tensor, instead of summing them pairwise; each pairwise sum
+        ## would rebuild (and recompress) an intermediate Tensor.
+        derivative_terms = []
+        for t_p in self:
+            d = diff(t_p, self.args[0])
+            if(d==0):
+                continue
+            if(isinstance(d, TensorFunction)):
+                derivative_terms.extend(d.tensor_products)
+            else:
+                derivative_terms.append(d)
+        T = Tensor(derivative_terms)
         try:
             return T.compress()
         except AttributeError:
@@ -861,6 +1161,78 @@ class TensorFunction(Function):
                 pass
             return T
 
+    def simplify(self):
+        """Simplify the coefficient of each tensor product
+
+        The arithmetic operations above deliberately leave their
+        coefficients unsimplified; call this once on the final result.
+
+        """
+        T = Tensor([t_p.simplify() for t_p in self])
+        try:
+            return T.compress()
+        except AttributeError:
+            return T
+
+    def cse(self, **kwargs):
+        """Eliminate common subexpressions among the coefficients
+
+        This runs `cse` over the coefficients of all the tensor
+        products at once, and returns `(replacements, reduced)`, where
+        `replacements` is the usual list of `(symbol, subexpression)`
+        pairs, and `reduced` is a new Tensor whose coefficients are
+        written in terms of those symbols.  This is mostly useful just
+        before generating numerical code from the coefficients, where
+        the contraction sums above leave many repeated subexpressions.
+        If the (faster) sumpy implementation of `cse` is installed, it
+        is used in place of sympy's.
+
+        """
+        try:
+            from sumpy.cse import cse
+        except ImportError:
+            from sympy import cse
+        replacements, reduced = cse([t_p.coefficient for t_p in self], **kwargs)
+        return replacements, Tensor([TensorProduct(list(t_p.vectors),
+                                                   coefficient=coefficient,
+                                                   symmetric=t_p.symmetric)
+                                     for t_p,coefficient in zip(self, reduced)])
+
+    def as_numba_function(self, free_symbols):
+        """Return a fast numerical function for the coefficients
+
+        This lambdifies the coefficients of all the tensor products at
+        once, as functions of the given symbols, for repeated
+        numerical evaluation -- e.g., over an array of time steps.  If
+        numba is installed and can compile the lambdified function in
+        nopython mode, the compiled version is returned; otherwise the
+        plain lambdified function is returned, which is already
+        vectorized over numpy arrays.
+
+        """
+        from sympy import lambdify
+        f = lambdify(free_symbols, [t_p.coefficient for t_p in self], modules='numpy')
+        try:
+            import numba
+        except ImportError:
+            return f
+        ## `lambdify` generates its function with exec, so numba's
+        ## on-disk cache would have no source file to key on, and
+        ## njit compiles lazily -- a nopython-mode failure would
+        ## otherwise surface only at the caller's first evaluation.
+        ## Force compilation on a probe input here, and fall back to
+        ## the plain lambdified function if numba can't handle it.
+        compiled = numba.njit(fastmath=True)(f)
+        if(isinstance(free_symbols, (list, tuple))):
+            probe = [0.0]*len(free_symbols)
+        else:
+            probe = [0.0]
+        try:
+            compiled(*probe)
+        except Exception:
+            return f
+        return compiled
+
     def series(self, *args, **kwargs):
         T = Tensor([c.series(*args, **kwargs) for c in self])
         try:
@@ -890,7 +1262,6 @@ class TensorFunction(Function):
     def _repr_latex_(self):
         return r'\begin{align}'+ self._latex_str_() + r'\end{align}'
 
-_Tensor_count = 0
 def Tensor(*tensor_products):
     """Create a new tensor"""
     ## First, go through and make the data nice
@@ -911,17 +1282,17 @@ def Tensor(*tensor_products):
                 if(t_p.rank != rank):
                     raise ValueError("Cannot add rank-{0} tensor to rank-{1} tensors.".format(t_p.rank, rank))
 
-    ## Now, create the object and set its data.  Because of sympy's
-    ## caching, tensors with different data need to be created as
-    ## classes with different names.  So we just create a lighweight
-    ## subclass with a unique name (the number at the end gets
-    ## incremented every time we construct a tensor).
-    global _Tensor_count
-    ThisTensorFunction = type('TensorFunction_'+str(_Tensor_count),
-                             (TensorFunction,), {})
-    _Tensor_count += 1
-    T = ThisTensorFunction( *tuple( set( flatten( [t_p.args for t_p in tensor_products] ) ) ) )
+    ## Now, create the object and set its data.  As in
+    ## `TensorProduct` above, the instance is created directly through
+    ## `Basic.__new__` to bypass sympy's instance cache, since the
+    ## list of tensor products is not part of the `args`.
+    argset = frozenset()
+    for t_p in tensor_products:
+        argset |= ArgumentSet(t_p)
+    T = Basic.__new__( TensorFunction, *tuple(argset) )
+    T._argument_set = argset
     T.tensor_products = tensor_products
+    T.rank = tensor_products[0].rank if tensor_products else sympify(0)
     return T
 
 